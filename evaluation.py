@@ -1,4 +1,5 @@
 import json
+import os
 from typing import Dict, List, Tuple
 import pandas as pd
 import streamlit as st
@@ -6,6 +7,10 @@ import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+import scoring
+from scoring import (build_question_index, build_short_questions, load_one_bank,
+                     scale_for, score_responses)
+
 
 # ============================================================
 #  STREAMLIT CONFIG
@@ -64,136 +69,144 @@ DISPLAY_NAME = {
 # ============================================================
 #  LOAD QUESTION BANKS
 # ============================================================
-@st.cache_data
-def load_question_banks():
-    banks = {}
+def bank_mtimes():
+    # Part of the disk-cache key, so an edited CSV (or bank-building code in
+    # scoring.py) invalidates persisted banks
+    return tuple(
+        os.path.getmtime(fn) if os.path.exists(fn) else None
+        for fn in [*QUESTION_FILES.values(), scoring.__file__]
+    )
+
+
+@st.cache_data(persist="disk", show_spinner=False)
+def load_question_banks(mtimes):
+    # Only the derived lookups are returned (and persisted), not the bank frames
+    question_index = {}
+    short_questions = {}
     for section, filename in QUESTION_FILES.items():
         try:
-            df = pd.read_csv(filename)
-            df.columns = [c.strip() for c in df.columns]
-            if "Type" in df.columns:
-                df["Type"] = df["Type"].astype(str).str.lower()
-            banks[section] = df
+            bank = load_one_bank(filename)
         except Exception as e:
             st.error(f"Could not load {filename}: {e}")
-            banks[section] = pd.DataFrame()
-    return banks
+            bank = pd.DataFrame()
+        question_index[section] = build_question_index(bank)
+        short_questions[section] = build_short_questions(bank)
+    return question_index, short_questions
 
 
-question_banks = load_question_banks()
+banks_version = bank_mtimes()
+question_index, short_questions = load_question_banks(banks_version)
 
 
 # ============================================================
 #  LOAD STUDENTS FROM FIRESTORE
 # ============================================================
-@st.cache_data
-def load_student_map():
-    student_map = {}
-    docs = db.collection("student_responses").stream()
-
+@st.cache_data(ttl=300, show_spinner=False)
+def load_rolls():
+    docs = db.collection("student_responses").select(["Roll", "Section"]).stream()
+    rolls = set()
     for snap in docs:
         data = snap.to_dict() or {}
-        roll = data.get("Roll")
-        section = data.get("Section")   # EXACT Firestore section
+        # Only rolls with at least one sectioned test have anything to evaluate
+        if data.get("Roll") and data.get("Section"):
+            rolls.add(data["Roll"])
+    return sorted(rolls)
 
-        if not roll or not section:
-            continue
 
-        if roll not in student_map:
-            student_map[roll] = {"docs": []}
+@st.cache_data(ttl=300, show_spinner=False)
+def load_docs_for_roll(roll):
+    query = db.collection("student_responses").where(
+        filter=firestore.FieldFilter("Roll", "==", roll)
+    )
+    return {snap.id: snap.to_dict() or {} for snap in query.stream()}
 
-        student_map[roll]["docs"].append((section, snap.id))
 
-    return student_map
+@st.cache_data(ttl=60, show_spinner=False)
+def load_student_summaries():
+    # One small doc per evaluated student, maintained by the Save transaction
+    docs = db.collection("student_summaries").stream()
+    return {snap.id: snap.to_dict() or {} for snap in docs}
 
 
-student_map = load_student_map()
-if not student_map:
-    st.warning("No student responses found.")
-    st.stop()
+def roll_label(roll):
+    summary = student_summaries.get(roll)
+    if not summary:
+        # Summaries only exist for saves made since they were introduced, so a
+        # missing one says nothing about whether the student was evaluated
+        return f"{roll} ? Status unknown"
 
+    completed = summary.get("completed") or {}
+    if all(completed.get(t) for t in summary.get("manual_tests", [])):
+        return f"{roll} ✔ Evaluated"
+    return f"{roll} ✖ Pending"
 
-# ============================================================
-#  SELECT STUDENT
-# ============================================================
-rolls_sorted = sorted(student_map.keys())
-selected_roll = st.selectbox("Select Student Roll Number", rolls_sorted)
 
-docs_for_student = student_map[selected_roll]["docs"]
+if st.sidebar.button("🔄 Refresh roster"):
+    load_rolls.clear()
+    load_docs_for_roll.clear()
+    load_student_summaries.clear()
 
-# Preload Firestore data
-doc_data_map = {}
-for section, doc_id in docs_for_student:
-    snap = db.collection("student_responses").document(doc_id).get()
-    doc_data_map[doc_id] = snap.to_dict() or {}
+rolls_sorted = load_rolls()
+if not rolls_sorted:
+    st.warning("No student responses found.")
+    st.stop()
+
+student_summaries = load_student_summaries()
 
 
 # ============================================================
-#  SCORE CALCULATION FUNCTIONS
+#  SELECT STUDENT
 # ============================================================
-def calc_mcq(df, responses):
-    if df.empty:
-        return 0
-
-    total = 0
-    for r in responses:
-        qid = str(r.get("QuestionID"))
-        ans = str(r.get("Response", "")).strip()
-
-        match = df[df["QuestionID"].astype(str) == qid]
-        if match.empty:
-            continue
-
-        row = match.iloc[0]
-        if row["Type"] != "mcq":
-            continue
-
-        correct = str(row.get("Answer", "")).strip()
-        if ans.lower() == correct.lower():
-            total += 1
-
-    return total
-
-
-def calc_likert(df, responses):
-    total = 0
-    for r in responses:
-        qid = str(r.get("QuestionID"))
-        resp_raw = r.get("Response", 0)
-
-        try:
-            val = int(str(resp_raw).strip())
-        except:
-            val = 0
-
-        match = df[df["QuestionID"].astype(str) == qid]
-        if match.empty:
-            continue
-
-        row = match.iloc[0]
-        if row["Type"] != "likert":
-            continue
+selected_roll = st.selectbox(
+    "Select Student Roll Number",
+    rolls_sorted,
+    format_func=roll_label
+)
 
-        total += max(0, min(4, val - 1))  # map 1–5 to 0–4
+# All of this student's tests come from one indexed Roll query
+doc_data_map = load_docs_for_roll(selected_roll)
+docs_for_student = [
+    (data["Section"], doc_id)   # EXACT Firestore section
+    for doc_id, data in doc_data_map.items()
+    if data.get("Section")
+]
+
+# Resubmissions rewrite Timestamp, so it doubles as a revision marker
+doc_revisions = tuple(
+    doc_data_map.get(doc_id, {}).get("Timestamp") for _, doc_id in docs_for_student
+)
 
-    return total
+saved_text_by_doc = {
+    doc_id: int((doc_data_map.get(doc_id, {}).get("Evaluation") or {}).get("text_total", 0) or 0)
+    for _, doc_id in docs_for_student
+}
 
 
 # ============================================================
 #  COMPUTE AUTO SCORES FOR ALL TESTS
 # ============================================================
-def compute_auto_scores_for_roll(docs):
+@st.cache_data(show_spinner=False)
+def compute_auto_scores_for_roll(roll, docs, revisions, banks_version, _doc_data_map):
+    # Keyed on (roll, docs, revisions, banks_version); _doc_data_map is not
+    # hashed, and banks_version re-scores everyone after an answer-key edit
     mcq_sum = 0
     likert_sum = 0
+    doc_scores = {}
     for section, doc_id in docs:
-        df = question_banks.get(section, pd.DataFrame())
-        data = doc_data_map[doc_id]
-        resp = data.get("Responses") or []
+        mcq = likert = 0
 
-        mcq_sum += calc_mcq(df, resp)
-        likert_sum += calc_likert(df, resp)
+        index = question_index.get(section)
+        if index is not None:
+            data = _doc_data_map.get(doc_id, {})
+            resp = data.get("Responses") or []
 
-    return mcq_sum, likert_sum
+            mcq, likert = score_responses(index, resp)
+
+        doc_scores[doc_id] = {"mcq": mcq, "likert": likert}
+        mcq_sum += mcq
+        likert_sum += likert
+
+    return mcq_sum, likert_sum, doc_scores
 
 
 # ============================================================
@@ -202,6 +215,9 @@ def compute_auto_scores_for_roll(docs):
 MANUAL_TESTS = ["Aptitude_Test", "Communication_Skills_-_Descriptive"]
 
 available_manual = [s for s, _ in docs_for_student if s in MANUAL_TESTS]
+if not available_manual:
+    st.warning("This student has no tests that need manual evaluation.")
+    st.stop()
 
 selected_test = st.selectbox(
     "Select Test for Manual Evaluation",
@@ -210,74 +226,66 @@ selected_test = st.selectbox(
 )
 
 selected_doc_id = [d for s, d in docs_for_student if s == selected_test][0]
-selected_doc = doc_data_map[selected_doc_id]
+selected_doc = doc_data_map.get(selected_doc_id, {})
 
 selected_responses = selected_doc.get("Responses") or []
 selected_eval = selected_doc.get("Evaluation") or {}
 saved_text_marks = selected_eval.get("text_marks", {})
 
-df_this = question_banks[selected_test]
-
 
 # ============================================================
 #  DESCRIPTIVE MARKING UI
 # ============================================================
-FOUR = {12, 13, 14, 16, 17, 18}
-THREE = {22, 23, 24, 25, 28, 29, 30, 34}
-
-def scale_for(qid):
-    try:
-        q = int(str(qid).replace("Q", ""))
-    except:
-        return [0, 1]
-
-    if q in FOUR:
-        return [0, 1, 2, 3]
-    if q in THREE:
-        return [0, 1, 2]
-    return [0, 1]
-
-
-short_df = df_this[df_this["Type"] == "short"]
-
 marks_given = {}
 text_total_current = 0
 
-for _, row in short_df.iterrows():
-    qid = str(row["QuestionID"])
-    qtext = row["Question"]
+resp_by_qid = {
+    str(r.get("QuestionID")).strip(): str(r.get("Response", "(no answer)"))
+    for r in selected_responses
+}
+
+# Radios inside a form don't rerun the script until the form is submitted
+with st.form("marking"):
+    for q in short_questions[selected_test]:
+        qid = q["QuestionID"]
+        qtext = q["Question"]
+
+        # Identify student's answer
+        student_answer = resp_by_qid.get(qid, "(no answer)")
 
-    # Identify student's answer
-    student_answer = "(no answer)"
-    for r in selected_responses:
-        if str(r.get("QuestionID")) == qid:
-            student_answer = str(r.get("Response", "(no answer)"))
+        scale = scale_for(qid)
+        default = saved_text_marks.get(qid, 0)
+        if default not in scale:
+            default = 0
 
-    scale = scale_for(qid)
-    default = saved_text_marks.get(qid, 0)
-    if default not in scale:
-        default = 0
+        with st.expander(f"Q{qid}: {qtext}", expanded=True):
+            st.write(f"**Answer:** {student_answer}")
+            mark = st.radio(
+                "Marks:",
+                scale,
+                index=scale.index(default),
+                horizontal=True,
+                key=f"m_{selected_doc_id}_{qid}"
+            )
 
-    with st.expander(f"Q{qid}: {qtext}", expanded=True):
-        st.write(f"**Answer:** {student_answer}")
-        mark = st.radio(
-            "Marks:",
-            scale,
-            index=scale.index(default),
-            horizontal=True,
-            key=f"m_{selected_doc_id}_{qid}"
-        )
+        marks_given[qid] = mark
+        text_total_current += mark
 
-    marks_given[qid] = mark
-    text_total_current += mark
+    submitted = st.form_submit_button("💾 Save Evaluation")
 
 
 # ============================================================
 #  AUTO + MANUAL TOTAL DISPLAY
 # ============================================================
-mcq_all, likert_all = compute_auto_scores_for_roll(docs_for_student)
+mcq_all, likert_all, doc_scores = compute_auto_scores_for_roll(
+    selected_roll, tuple(docs_for_student), doc_revisions, banks_version, doc_data_map
+)
+
+saved_text_other = sum(
+    total for did, total in saved_text_by_doc.items() if did != selected_doc_id
+)
 
-grand_total = mcq_all + likert_all + text_total_current
+grand_total = mcq_all + likert_all + saved_text_other + text_total_current
 
 st.write(f"**MCQ Score (Auto):** {mcq_all}")
 st.write(f"**Likert Score (Auto):** {likert_all}")
@@ -288,39 +296,73 @@ st.subheader(f"GRAND TOTAL (All Tests) = {grand_total}")
 # ============================================================
 #  SAVE EVALUATION
 # ============================================================
-if st.button("💾 Save Evaluation"):
+@firestore.transactional
+def commit_evaluation(transaction, selected_ref, sibling_refs, updates, own_total,
+                      summary_ref, summary):
+    # Re-read siblings in the transaction so text marks saved concurrently
+    # on the student's other tests are counted in grand_total. The refs come
+    # from the cached roll query, so skip any test deleted since then
+    siblings = [snap for snap in transaction.get_all(sibling_refs) if snap.exists]
+    saved_text_other = 0
+    for snap in siblings:
+        ev = (snap.to_dict() or {}).get("Evaluation") or {}
+        saved_text_other += int(ev.get("text_total", 0) or 0)
+
+    grand_total = own_total + saved_text_other
+
+    transaction.update(selected_ref, {**updates, "Evaluation.grand_total": grand_total})
+    for snap in siblings:
+        transaction.update(snap.reference, {"Evaluation.grand_total": grand_total})
+    transaction.set(summary_ref, {**summary, "grand_total": grand_total}, merge=True)
+
+    return grand_total
+
+
+if submitted:
 
     text_marks_dict = {qid: int(mark) for qid, mark in marks_given.items()}
-    text_total = sum(text_marks_dict.values())
+    text_total = text_total_current
 
-    # Compute MCQ + Likert JUST for this test
-    auto_mcq = calc_mcq(df_this, selected_responses)
-    auto_likert = calc_likert(df_this, selected_responses)
+    # MCQ + Likert JUST for this test, already scored during render
+    auto_mcq = doc_scores[selected_doc_id]["mcq"]
+    auto_likert = doc_scores[selected_doc_id]["likert"]
     final_total = auto_mcq + auto_likert + text_total
 
-    # Compute GRAND TOTAL again
-    mcq_all, likert_all = compute_auto_scores_for_roll(docs_for_student)
+    # Save to Firestore (one read-then-write transaction); mcq_all and
+    # likert_all come from the render pass above in this same run
+    coll = db.collection("student_responses")
+    doc_ref = coll.document(selected_doc_id)
+    sibling_refs = [coll.document(did) for _, did in docs_for_student if did != selected_doc_id]
 
-    saved_text_other = 0
-    for sec, did in docs_for_student:
-        if sec != selected_test:
-            ev = doc_data_map[did].get("Evaluation", {})
-            saved_text_other += int(ev.get("text_total", 0))
-
-    grand_total = mcq_all + likert_all + saved_text_other + text_total
-
-    # Save to Firestore
-    doc_ref = db.collection("student_responses").document(selected_doc_id)
-
-    new_eval = {
-        "mcq_total": auto_mcq,
-        "likert_total": auto_likert,
-        "text_total": text_total,
-        "final_total": final_total,
-        "grand_total": grand_total,
-        "text_marks": text_marks_dict,
+    # Send only the Evaluation subfields; FieldPath quotes numeric QIDs like "1"
+    updates = {
+        firestore.FieldPath("Evaluation", "text_marks", qid).to_api_repr(): mark
+        for qid, mark in text_marks_dict.items()
+    }
+    updates.update({
+        "Evaluation.mcq_total": auto_mcq,
+        "Evaluation.likert_total": auto_likert,
+        "Evaluation.text_total": text_total,
+        "Evaluation.final_total": final_total,
+    })
+
+    # Denormalized status so the roll dropdown needs no fan-out reads
+    summary_ref = db.collection("student_summaries").document(selected_roll)
+    summary = {
+        "Roll": selected_roll,
+        "manual_tests": available_manual,
+        "completed": {selected_test: True},
+        "totals": {selected_test: final_total},
     }
 
-    doc_ref.set({"Evaluation": new_eval}, merge=True)
-
-    st.success("Evaluation saved successfully!")
+    grand_total = commit_evaluation(
+        db.transaction(), doc_ref, sibling_refs, updates,
+        mcq_all + likert_all + text_total,
+        summary_ref, summary,
+    )
+    # Only this student's cached docs are stale; auto scores depend on the
+    # unchanged responses, so their cache entries stay valid
+    load_docs_for_roll.clear(selected_roll)
+    load_student_summaries.clear()
+
+    st.success(f"Evaluation saved successfully! Grand total: {grand_total}")
@@ -2,7 +2,10 @@ import streamlit as st
 import pandas as pd
 import firebase_admin
 from firebase_admin import credentials, firestore
+import csv
+import io
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # -------------------------------------
 # Firebase init
@@ -46,78 +49,108 @@ SECTION_ORDER = [
 ]
 
 
-# ------------------------------------------------------------
-# LOAD ALL DOCUMENTS
-# ------------------------------------------------------------
-rows = []
+# Which auto/manual components make up each test's final score
+SECTION_RULES = {
+    "Adaptability & Learning":            {"mcq": False, "likert": True,  "text": False},
+    "Aptitude Test":                      {"mcq": True,  "likert": False, "text": True},
+    "Communication Skills - Descriptive": {"mcq": False, "likert": False, "text": True},
+    "Communication Skills - Objective":   {"mcq": True,  "likert": False, "text": False},
+}
+
+SCORE_COLUMNS = {
+    "mcq": "MCQ Score",
+    "likert": "Likert Score",
+    "text": "Text Score",
+}
 
-docs = db.collection("student_responses").stream()
 
-for snap in docs:
-    data = snap.to_dict() or {}
+# Missing or blank key fields; isin() also matches NaN against None
+EMPTY_VALUES = frozenset({None, ""})
 
-    roll = data.get("Roll")
-    section = data.get("Section")
-    evalb = data.get("Evaluation") or {}
 
-    if not roll or not section:
-        continue
+# Firestore field -> export column
+EXPORT_FIELDS = {
+    "Roll": "Roll Number",
+    "Section": "Section",
+    "Evaluation.mcq_total": "MCQ Score",
+    "Evaluation.likert_total": "Likert Score",
+    "Evaluation.final_total": "Text Score",
+    "Evaluation.grand_total": "Grand Total (All Tests)",
+}
 
-    # Extract values
-    mcq = evalb.get("mcq_total")
-    likert = evalb.get("likert_total")
-    text = evalb.get("final_total")
-    grand = evalb.get("grand_total")
+
+# ------------------------------------------------------------
+# LOAD ALL DOCUMENTS
+# ------------------------------------------------------------
+@st.cache_data(ttl=60)
+def fetch_responses(partitions=8):
+    # Split the collection into key ranges and page through them concurrently,
+    # shipping only the fields the export reads (not the Responses array)
+    group = db.collection_group("student_responses")
+    queries = [
+        p.query().select(["Roll", "Section", "Evaluation"])
+        for p in group.get_partitions(partitions)
+    ]
+
+    def read(query):
+        # The group also matches nested student_responses subcollections;
+        # keep only top-level docs, the ones evaluation.py reads and writes
+        return [
+            snap.to_dict() or {}
+            for snap in query.stream()
+            if snap.reference.parent.parent is None
+        ]
+
+    with ThreadPoolExecutor(max_workers=partitions) as ex:
+        return [data for chunk in ex.map(read, queries) for data in chunk]
+
+
+@st.cache_data(ttl=60)
+def load_marks():
+    # Flatten one level so Evaluation.* become columns (text_marks stays a dict)
+    raw = pd.json_normalize(fetch_responses(), max_level=1)
+    df = raw.reindex(columns=list(EXPORT_FIELDS)).rename(columns=EXPORT_FIELDS)
+    keep = ~df[["Roll Number", "Section"]].isin(EMPTY_VALUES).any(axis=1)
+    df = df[keep].reset_index(drop=True)
+
+    # Scores stay nullable integers; missing ones become N/A only when rendered.
+    # A column holding a non-integral value (e.g. 2.5) stays Float64 instead
+    for col in [*SCORE_COLUMNS.values(), "Grand Total (All Tests)"]:
+        values = pd.to_numeric(df[col], errors="coerce")
+        integral = values.isna() | (values % 1 == 0)
+        df[col] = values.astype("Int64" if integral.all() else "Float64")
 
     # -----------------------------------------
     # COMPUTE FINAL SCORE PER TEST
     # -----------------------------------------
-    if section == "Adaptability & Learning":              # Likert only
-        final_score = likert if likert not in (None, "", 0) else "N/A"
-
-    elif section == "Aptitude Test":                      # MCQ + Text
-        m = mcq if isinstance(mcq, int) else 0
-        t = text if isinstance(text, int) else 0
-        final_score = m + t if (m + t) > 0 else "N/A"
-
-    elif section == "Communication Skills - Descriptive": # Text only
-        final_score = text if text not in (None, "", 0) else "N/A"
-
-    elif section == "Communication Skills - Objective":   # MCQ only
-        final_score = mcq if mcq not in (None, "", 0) else "N/A"
+    rules = pd.DataFrame.from_dict(SECTION_RULES, orient="index")
+    rules = rules.reindex(df["Section"], fill_value=False)
 
-    else:
-        final_score = "N/A"
+    final_score = pd.Series(0, index=df.index, dtype="Int64")
+    for key, col in SCORE_COLUMNS.items():
+        final_score += df[col].fillna(0) * rules[key].to_numpy()
 
-    # Replace None/"" with N/A for export
-    mcq = mcq if mcq not in (None, "") else "N/A"
-    likert = likert if likert not in (None, "") else "N/A"
-    text = text if text not in (None, "") else "N/A"
-    grand = grand if grand not in (None, "") else "N/A"
+    df["Final Score (This Test)"] = final_score.where(final_score > 0)
 
-    rows.append([
-        roll,
-        section,
-        mcq,
-        likert,
-        text,
-        final_score,
-        grand,
-    ])
+    return df[[
+        "Roll Number",
+        "Section",
+        "MCQ Score",
+        "Likert Score",
+        "Text Score",
+        "Final Score (This Test)",
+        "Grand Total (All Tests)",
+    ]]
 
 
 # ------------------------------------------------------------
 # BUILD DATAFRAME
 # ------------------------------------------------------------
-df = pd.DataFrame(rows, columns=[
-    "Roll Number",
-    "Section",
-    "MCQ Score",
-    "Likert Score",
-    "Text Score",
-    "Final Score (This Test)",
-    "Grand Total (All Tests)",
-])
+if st.button("🔄 Refresh"):
+    fetch_responses.clear()
+    load_marks.clear()
+
+df = load_marks()
 
 # Apply section order
 cat = pd.CategoricalDtype(categories=SECTION_ORDER, ordered=True)
@@ -126,20 +159,17 @@ df = df.sort_values(["Roll Number", "Section"])
 
 
 # ------------------------------------------------------------
-# SHOW GRAND TOTAL ONLY ON FIRST ROW OF EACH STUDENT
+# RENDER N/A, GRAND TOTAL ONLY ON FIRST ROW OF EACH STUDENT
 # ------------------------------------------------------------
-clean_rows = []
-last = None
-
-for _, row in df.iterrows():
-    rr = row.copy()
-    if rr["Roll Number"] == last:
-        rr["Grand Total (All Tests)"] = ""
-    else:
-        last = rr["Roll Number"]
-    clean_rows.append(rr)
+df_final = df.copy()
+for col in [*SCORE_COLUMNS.values(), "Final Score (This Test)", "Grand Total (All Tests)"]:
+    shown = df[col].astype(object)
+    if df[col].dtype == "Float64":
+        # Only the odd fractional score should print with a decimal point
+        shown = shown.map(lambda v: int(v) if isinstance(v, float) and v.is_integer() else v)
+    df_final[col] = shown.where(df[col].notna(), "N/A")
 
-df_final = pd.DataFrame(clean_rows)
+df_final.loc[df["Roll Number"].duplicated(), "Grand Total (All Tests)"] = ""
 
 
 # ------------------------------------------------------------
@@ -147,11 +177,20 @@ df_final = pd.DataFrame(clean_rows)
 # ------------------------------------------------------------
 st.dataframe(df_final, use_container_width=True)
 
-csv = df_final.to_csv(index=False).encode("utf-8")
+def to_csv_bytes(frame):
+    # Columns mix ints with "N/A"; csv.writer skips pandas' object-dtype formatter
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(frame.columns)
+    # Sections outside SECTION_ORDER are NaN in the categorical; write them blank
+    frame = frame.astype(object).where(frame.notna(), None)
+    writer.writerows(frame.itertuples(index=False, name=None))
+    return buf.getvalue().encode("utf-8")
+
 
 st.download_button(
     "⬇ Download CSV",
-    csv,
+    to_csv_bytes(df_final),
     "evaluated_marks.csv",
     "text/csv",
 )
@@ -46,6 +46,11 @@ files = {
     "Communication Skills - Descriptive": "communication_skills_descriptive.csv",
 }
 
+# Parsed once per process; every widget interaction reruns this script
+@st.cache_data
+def load_questions(filename):
+    return pd.read_csv(filename)
+
 # ---- inputs ----
 name = st.text_input("Enter Your Name (letters only)", value="")
 roll  = st.text_input("Enter Roll Number (e.g., 25BBAB001)", value="")
@@ -80,7 +85,7 @@ if name and roll:
                
     if section:
         try:
-            df = pd.read_csv(files[section])
+            df = load_questions(files[section])
         except FileNotFoundError:
             st.error(f"❌ File '{files[section]}' not found. Please check the file name.")
             st.stop()
@@ -0,0 +1,123 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# ============================================================
+#  QUESTION BANK PREPARATION
+# ============================================================
+@lru_cache(maxsize=4096)
+def norm_answer(text):
+    # MCQ picks and keys repeat from a small option set; callers pass str()
+    # so unhashable responses (lists, dicts) never reach the cache
+    return text.strip().lower()
+
+
+def build_question_index(df):
+    # QuestionID-indexed Type/normalized Answer view; first row wins on duplicate IDs
+    if df.empty:
+        return pd.DataFrame(columns=["Type", "Answer"])
+
+    index = pd.DataFrame({
+        "QuestionID": df["QuestionID"],
+        "Type": df.get("Type", ""),
+        "Answer": df.get("_correct", ""),
+    })
+    return index.drop_duplicates("QuestionID").set_index("QuestionID")
+
+
+def build_short_questions(df):
+    # Descriptive questions as plain records for the marking UI
+    if df.empty:
+        return []
+
+    short = df[df["Type"] == "short"]
+    return [
+        {"QuestionID": str(qid), "Question": qtext}
+        for qid, qtext in zip(short["QuestionID"], short["Question"])
+    ]
+
+
+# Columns the scorer and marking UI read
+ANSWER_COLUMN = "Answer"
+BANK_COLUMNS = ["QuestionID", "Type", "Question", ANSWER_COLUMN]
+
+
+def read_bank_csv(path):
+    # Skip option text and section labels; Arrow parses and stores the rest
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c.strip() in BANK_COLUMNS]
+    return pd.read_csv(path, usecols=usecols, engine="pyarrow", dtype_backend="pyarrow")
+
+
+def load_one_bank(filename):
+    df = read_bank_csv(filename)
+    df.columns = [c.strip() for c in df.columns]
+    if "QuestionID" in df.columns:
+        df["QuestionID"] = df["QuestionID"].astype(str).str.strip().astype("category")
+    if "Type" in df.columns:
+        df["Type"] = df["Type"].astype(str).str.strip().str.lower().astype("category")
+
+    # Normalize the answer key once; scoring compares against _correct only.
+    # Banks without an Answer column key every MCQ to "", as they always have
+    if ANSWER_COLUMN in df.columns:
+        df["_correct"] = df[ANSWER_COLUMN].map(lambda v: norm_answer(str(v)), na_action="ignore")
+    else:
+        df["_correct"] = norm_answer("")
+
+    return df
+
+
+# ============================================================
+#  SCORE CALCULATION FUNCTIONS
+# ============================================================
+def merge_responses(index, responses):
+    rdf = pd.DataFrame(responses, columns=["QuestionID", "Response"])
+    rdf["QuestionID"] = rdf["QuestionID"].astype(str).str.strip()
+    return rdf.merge(index, left_on="QuestionID", right_index=True)
+
+
+def mcq_total(m):
+    # Normalize MCQ picks only; essays and Likert ints stay out of the intern cache
+    mcq = m[m["Type"] == "mcq"]
+    ans = mcq["Response"].fillna("").map(lambda v: norm_answer(str(v)))
+    return int((ans == mcq["Answer"]).sum())
+
+
+# Likert answer -> points; index is the answer clipped to 0–5 (1–5 map to 0–4)
+LIKERT_POINTS = np.array([0, 0, 1, 2, 3, 4])
+
+
+def likert_total(m):
+    raw = m.loc[m["Type"] == "likert", "Response"].astype(str).str.strip()
+    vals = pd.to_numeric(raw, errors="coerce").fillna(0).to_numpy(dtype=int)
+    return int(LIKERT_POINTS[vals.clip(0, 5)].sum())
+
+
+def score_responses(index, responses):
+    # One merge feeds both reductions; returns (mcq, likert)
+    m = merge_responses(index, responses)
+    return mcq_total(m), likert_total(m)
+
+
+# ============================================================
+#  DESCRIPTIVE MARK SCALES
+# ============================================================
+FOUR = {12, 13, 14, 16, 17, 18}
+THREE = {22, 23, 24, 25, 28, 29, 30, 34}
+
+SCALE_BY_QID = {q: [0, 1, 2, 3] for q in FOUR} | {q: [0, 1, 2] for q in THREE}
+DEFAULT_SCALE = [0, 1]
+
+
+@lru_cache(maxsize=1024)
+def parse_int_qid(qid):
+    try:
+        return int(str(qid).replace("Q", ""))
+    except:
+        return None
+
+
+def scale_for(qid):
+    return SCALE_BY_QID.get(parse_int_qid(qid), DEFAULT_SCALE)